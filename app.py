@@ -1,10 +1,15 @@
+import copy
+import datetime
+import hashlib
 import os  # type: ignore
-from typing import Any, Optional
+from typing import Any, Callable, Iterator, Optional, Sequence
 
 import dash  # type: ignore
 import dash_core_components as dcc  # type: ignore
 import dash_html_components as html  # type: ignore
 import dash_table  # type: ignore
+import flask  # type: ignore
+import numpy as np  # type: ignore
 import pandas as pd  # type: ignore
 import plotly.graph_objects as go  # type: ignore
 from dash.dependencies import Input, Output  # type: ignore
@@ -45,8 +50,12 @@ app.index_string = """<!DOCTYPE html>
 app.title = "Hilton Compass | Welcome"
 
 # API keys and datasets
+# REVIEWS_CSV lets the app run against a local or resized copy (e.g. loadtest.py)
 reviews = pd.read_csv(
-    "https://raw.githubusercontent.com/sebastianrosado/hilton-compass/master/countries_trimmed.csv"
+    os.environ.get(
+        "REVIEWS_CSV",
+        "https://raw.githubusercontent.com/sebastianrosado/hilton-compass/master/countries_trimmed.csv",
+    )
 )
 
 reviews = reviews[
@@ -162,6 +171,8 @@ fig2.update_layout(
     ),
 )
 
+fig2_dict = fig2.to_dict()
+
 # Tab styles
 tabs_styles = {"height": "44px", "font-size": "1.2vw"}
 
@@ -613,27 +624,22 @@ def update_map_location(value: str):
     """
     dff = city_df
 
-    fig2.update_layout(
-        hovermode="closest",
-        margin={"r": 0, "t": 0, "l": 0, "b": 0},
-        mapbox=go.layout.Mapbox(
-            accesstoken=mapbox_access_token,
-            style="light",
-            bearing=0,
-            center=go.layout.mapbox.Center(
-                lat=48.7329446
-                if value == "Anywhere"
-                else dff.loc[dff["city"] == value, "lat"].values[0],
-                lon=5.0126286
-                if value == "Anywhere"
-                else dff.loc[dff["city"] == value, "lon"].values[0],
-            ),
-            pitch=0,
-            zoom=2.5 if value == "Anywhere" else 8,
-        ),
+    # Plotly graph objects aren't thread-safe, so build a plain dict figure
+    # rather than updating the shared fig2 from threaded workers
+    fig = copy.deepcopy(fig2_dict)
+    fig["layout"]["mapbox"].update(
+        center={
+            "lat": 48.7329446
+            if value == "Anywhere"
+            else float(dff.loc[dff["city"] == value, "lat"].values[0]),
+            "lon": 5.0126286
+            if value == "Anywhere"
+            else float(dff.loc[dff["city"] == value, "lon"].values[0]),
+        },
+        zoom=2.5 if value == "Anywhere" else 8,
     )
 
-    return fig2
+    return fig
 
 
 @app.callback(
@@ -688,5 +694,221 @@ def update_negative_reviews(derived_virtual_selected_rows: int) -> Optional[Any]
     )
 
 
+# REST API
+API_CHUNK_ROWS = 500
+
+api_columns = {
+    "Review Date": "review_date",
+    "Hotel": "hotel",
+    "Hotel Address": "hotel_address",
+    "Average Rating": "average_rating",
+    "Reviewer Nationality": "reviewer_nationality",
+    "Reviewer Score": "reviewer_score",
+    "Negative Review": "negative_review",
+    "Positive Review": "positive_review",
+    "Total User Reviews Submitted": "total_number_of_reviews_reviewer_has_given",
+    "Lat": "lat",
+    "Lon": "lon",
+}
+
+# Parsed once so the date filters don't re-parse the column on every request
+review_dates = pd.to_datetime(df_copy["Review Date"], format="%m/%d/%Y").to_numpy()
+
+hotels_df = (
+    reduced_df_copy[["Hotel", "Hotel Address", "Average Rating", "Lat", "Lon"]]
+    .rename(columns=api_columns)
+    .merge(
+        value_counts_df.rename(columns={"Hotel": "hotel", "Counts": "reviews"}),
+        on="hotel",
+    )
+    .reset_index(drop=True)
+)
+
+# Changes whenever the loaded reviews change, so clients can revalidate with ETags
+dataset_version = hashlib.sha1(
+    pd.util.hash_pandas_object(df_copy, index=False).values.tobytes()
+).hexdigest()[:16]
+
+export_mimetypes = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def review_chunk(chunk: pd.DataFrame, positions: Sequence[int]) -> pd.DataFrame:
+    """Rename a slice of df_copy to API column names with ISO review dates."""
+    chunk = chunk.drop(columns="id").rename(columns=api_columns)
+    chunk["review_date"] = np.datetime_as_string(review_dates[positions], unit="D")
+    return chunk
+
+
+def stream_rows(
+    frame: pd.DataFrame,
+    positions: Sequence[int],
+    fmt: str,
+    prepare: Callable[[pd.DataFrame, Sequence[int]], pd.DataFrame],
+) -> Iterator[str]:
+    """Yield the selected rows of a data frame as CSV or NDJSON chunks.
+
+    Parameters
+    ----------
+    frame
+        The data frame to export.
+    positions
+        Row positions to export, in order.
+    fmt
+        Either 'csv' or 'ndjson'.
+    prepare
+        Called with each slice and its row positions before it is serialised,
+        e.g. to rename columns.
+
+    Returns
+    -------
+    Iterator
+        At most API_CHUNK_ROWS rows are sliced and serialised at a time, so
+        memory use does not grow with the size of the export.
+
+    """
+    if fmt == "csv":
+        yield prepare(frame.iloc[:0], []).to_csv(index=False)
+    for start in range(0, len(positions), API_CHUNK_ROWS):
+        chunk_positions = positions[start : start + API_CHUNK_ROWS]
+        chunk = prepare(frame.iloc[chunk_positions], chunk_positions)
+        if fmt == "csv":
+            yield chunk.to_csv(index=False, header=False)
+        else:
+            lines = chunk.to_json(orient="records", lines=True, force_ascii=False)
+            yield lines.rstrip("\n") + "\n"
+
+
+def export_response(
+    frame: pd.DataFrame,
+    positions: Sequence[int],
+    prepare: Callable[[pd.DataFrame, Sequence[int]], pd.DataFrame] = (
+        lambda chunk, positions: chunk
+    ),
+) -> flask.Response:
+    """Stream rows in the requested format, honouring If-None-Match.
+
+    Parameters
+    ----------
+    frame
+        The data frame to export.
+    positions
+        Row positions to export, in order.
+    prepare
+        Called with each slice and its row positions before it is serialised.
+
+    Returns
+    -------
+    Object
+        A chunked CSV or NDJSON response, a 304 if the client's copy is current,
+        or a 400 for an unknown format.
+
+    """
+    fmt = flask.request.args.get("format")
+    if fmt is None:
+        best = flask.request.accept_mimetypes.best_match(
+            ["application/x-ndjson", "text/csv"], default="application/x-ndjson"
+        )
+        fmt = "csv" if best == "text/csv" else "ndjson"
+    if fmt not in export_mimetypes:
+        return flask.jsonify(error="format must be 'csv' or 'ndjson'"), 400
+
+    etag = "{}-{}".format(dataset_version, fmt)
+    if flask.request.if_none_match.contains_weak(etag):
+        response = flask.Response(status=304)
+    else:
+        response = flask.Response(
+            stream_rows(frame, positions, fmt, prepare),
+            mimetype=export_mimetypes[fmt],
+        )
+    response.set_etag(etag)
+    response.vary.add("Accept")
+    return response
+
+
+def filtered_review_positions(mask: np.ndarray) -> Sequence[int]:
+    """Narrow a row mask over df_copy with the request's review filters.
+
+    The optional 'nationality' (case-insensitive), 'from' and 'to' (inclusive
+    YYYY-MM-DD dates) query parameters are applied. An invalid date aborts the
+    request with a 400.
+
+    Parameters
+    ----------
+    mask
+        Boolean array with one entry per row of df_copy.
+
+    Returns
+    -------
+    Sequence
+        Positions of the matching rows.
+
+    """
+    nationality = flask.request.args.get("nationality")
+    if nationality:
+        wanted = nationality.strip().lower()
+        matches = [
+            value
+            for value in df_copy["Reviewer Nationality"].dropna().unique()
+            if value.strip().lower() == wanted
+        ]
+        mask = mask & df_copy["Reviewer Nationality"].isin(matches).to_numpy()
+
+    for param, compare in (("from", np.greater_equal), ("to", np.less_equal)):
+        value = flask.request.args.get(param)
+        if not value:
+            continue
+        try:
+            day = np.datetime64(datetime.date.fromisoformat(value), "ns")
+        except (TypeError, ValueError):
+            flask.abort(
+                flask.make_response(
+                    flask.jsonify(error="{} must be an ISO date".format(param)), 400
+                )
+            )
+        mask = mask & compare(review_dates, day)
+
+    if mask.all():
+        return range(len(mask))
+    return mask.nonzero()[0]
+
+
+@server.route("/api/hotels")
+def api_hotels():
+    """List every hotel with its address, average rating and review count."""
+    return export_response(hotels_df, range(len(hotels_df)))
+
+
+@server.route("/api/reviews")
+def api_reviews():
+    """Export every review, filtered like /api/hotels/<name>/reviews."""
+    positions = filtered_review_positions(np.ones(len(df_copy), dtype=bool))
+    return export_response(df_copy, positions, review_chunk)
+
+
+@server.route("/api/hotels/<name>/reviews")
+def api_hotel_reviews(name: str):
+    """Export the reviews of a single hotel.
+
+    Accepts the 'nationality', 'from' and 'to' filters, and 'format' picks 'csv'
+    or 'ndjson' over the Accept header.
+
+    Parameters
+    ----------
+    name
+        The hotel name, exactly as listed by /api/hotels.
+
+    Returns
+    -------
+    Object
+        A streamed export, or a 404/400 JSON error.
+
+    """
+    mask = (df_copy["Hotel"] == name).to_numpy()
+    if not mask.any():
+        return flask.jsonify(error="unknown hotel: {}".format(name)), 404
+
+    return export_response(df_copy, filtered_review_positions(mask), review_chunk)
+
+
 if __name__ == "__main__":
     app.run_server(debug=False)
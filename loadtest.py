@@ -0,0 +1,433 @@
+"""Replay scripted dashboard sessions against a local gunicorn server.
+
+Each session loads ``_dash-layout``, moves ``location-dropdown`` through every
+city in the dropdown and selects table rows so that both review callbacks
+fire. The report shows throughput, p50/p95/p99 latency and the RSS of every
+gunicorn worker, so worker counts, worker classes and data sizes can be
+compared before deploying.
+
+The server is started with stubbed Mapbox credentials and reads the bundled
+``countries_trimmed.csv`` (optionally repeated ``--scale`` times), so no
+network access is needed.
+
+Example::
+
+    python loadtest.py --workers 2 --worker-class sync --concurrency 8 --sessions 40
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd  # type: ignore
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATASET = os.path.join(HERE, "countries_trimmed.csv")
+
+# (endpoint label, seconds, succeeded)
+Sample = Tuple[str, float, bool]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Return the nearest-rank percentile of ``values``.
+
+    Parameters
+    ----------
+    values
+        Unsorted measurements.
+    pct
+        Percentile between 0 and 100.
+
+    Returns
+    -------
+    float
+
+    """
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def write_dataset(scale: int, directory: str) -> str:
+    """Write the bundled dataset repeated ``scale`` times and return its path."""
+    if scale <= 1:
+        return DATASET
+    data = pd.read_csv(DATASET)
+    path = os.path.join(directory, "reviews_x{}.csv".format(scale))
+    pd.concat([data] * scale, ignore_index=True).to_csv(path, index=False)
+    return path
+
+
+def free_port() -> int:
+    """Return a localhost port that nothing is listening on right now."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def start_server(
+    port: int, workers: int, worker_class: str, threads: int, dataset: str
+) -> subprocess.Popen:
+    """Start ``gunicorn app:server`` offline with stubbed Mapbox settings."""
+    env = dict(os.environ)
+    env.setdefault("MAPBOX_STYLE", "stub-style")
+    env.setdefault("MAPBOX_KEY", "stub-key")
+    env["REVIEWS_CSV"] = dataset
+    command = [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        "app:server",
+        "--bind",
+        "127.0.0.1:{}".format(port),
+        "--workers",
+        str(workers),
+        "--worker-class",
+        worker_class,
+    ]
+    # gunicorn quietly swaps sync for gthread when --threads > 1, so only pass
+    # it for gthread and keep the reported worker class honest.
+    if worker_class == "gthread":
+        command += ["--threads", str(threads)]
+    return subprocess.Popen(command, cwd=HERE, env=env)
+
+
+def wait_until_ready(
+    base_url: str, server: Optional[subprocess.Popen], timeout: float
+) -> None:
+    """Poll the index page until the server answers or ``timeout`` expires."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError("gunicorn exited with code {}".format(server.returncode))
+        try:
+            with urllib.request.urlopen(base_url + "/", timeout=2) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.25)
+    raise RuntimeError("server at {} not ready after {}s".format(base_url, timeout))
+
+
+def worker_pids(master_pid: int) -> List[int]:
+    """Return the pids of the direct children of ``master_pid`` (Linux only)."""
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/{}/stat".format(entry)) as handle:
+                stat = handle.read()
+        except OSError:
+            continue
+        # The command name may contain spaces, so split after its closing paren.
+        fields = stat[stat.rfind(")") + 2 :].split()
+        if int(fields[1]) == master_pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def rss_kib(pid: int) -> Optional[int]:
+    """Return the resident set size of ``pid`` in KiB, or None if it is gone."""
+    try:
+        with open("/proc/{}/status".format(pid)) as handle:
+            for line in handle:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+class RssSampler(threading.Thread):
+    """Periodically record peak and latest RSS for every gunicorn worker."""
+
+    def __init__(self, master_pid: int, interval: float = 0.5) -> None:
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.interval = interval
+        self.peak: Dict[int, int] = {}
+        self.last: Dict[int, int] = {}
+        self._stop_event = threading.Event()
+
+    def sample(self) -> None:
+        for pid in worker_pids(self.master_pid):
+            rss = rss_kib(pid)
+            if rss is None:
+                continue
+            self.last[pid] = rss
+            self.peak[pid] = max(self.peak.get(pid, 0), rss)
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            self.sample()
+            self._stop_event.wait(self.interval)
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+        self.sample()
+
+
+def find_component(node: Any, component_id: str) -> Optional[Dict[str, Any]]:
+    """Depth-first search of a serialised Dash layout for ``component_id``."""
+    if isinstance(node, list):
+        for child in node:
+            found = find_component(child, component_id)
+            if found is not None:
+                return found
+    elif isinstance(node, dict):
+        props = node.get("props", {})
+        if props.get("id") == component_id:
+            return node
+        return find_component(props.get("children"), component_id)
+    return None
+
+
+def timed_request(
+    label: str, url: str, payload: Optional[Dict[str, Any]] = None
+) -> Tuple[Sample, Optional[bytes]]:
+    """Issue a GET (or a JSON POST when ``payload`` is given) and time it."""
+    data = None
+    headers = {}
+    if payload is not None:
+        data = json.dumps(payload).encode("utf-8")
+        headers["Content-Type"] = "application/json"
+    request = urllib.request.Request(url, data=data, headers=headers)
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            body = response.read()
+        return (label, time.perf_counter() - start, True), body
+    except (urllib.error.URLError, http.client.HTTPException, OSError):
+        # HTTPException covers bodies cut off by a worker timeout (IncompleteRead)
+        return (label, time.perf_counter() - start, False), None
+
+
+def callback_payload(
+    output_id: str, output_prop: str, input_id: str, input_prop: str, value: Any
+) -> Dict[str, Any]:
+    """Build the body the Dash renderer posts to ``_dash-update-component``."""
+    return {
+        "output": "{}.{}".format(output_id, output_prop),
+        "outputs": {"id": output_id, "property": output_prop},
+        "inputs": [{"id": input_id, "property": input_prop, "value": value}],
+        "changedPropIds": ["{}.{}".format(input_id, input_prop)],
+        "state": [],
+    }
+
+
+def run_session(
+    base_url: str, cities: List[str], row_count: int, rows: int, seed: int
+) -> List[Sample]:
+    """Replay one user session and return a sample for every request."""
+    rng = random.Random(seed)
+    update_url = base_url + "/_dash-update-component"
+    samples = [timed_request("_dash-layout", base_url + "/_dash-layout")[0]]
+
+    for city in cities:
+        payload = callback_payload(
+            "map-graph", "figure", "location-dropdown", "value", city
+        )
+        samples.append(timed_request("location-dropdown", update_url, payload)[0])
+
+    for _ in range(rows):
+        selected = [rng.randrange(row_count)]
+        for textbox in ("positive-textbox", "negative-textbox"):
+            payload = callback_payload(
+                textbox, "value", "datatable", "derived_virtual_selected_rows", selected
+            )
+            samples.append(timed_request(textbox, update_url, payload)[0])
+
+    return samples
+
+
+def report(
+    samples: List[Sample],
+    elapsed: float,
+    sessions: int,
+    sampler: Optional[RssSampler],
+) -> Dict[str, Any]:
+    """Summarise samples and worker memory into a JSON-serialisable dict."""
+    by_label: Dict[str, List[Sample]] = {}
+    for sample in samples:
+        by_label.setdefault(sample[0], []).append(sample)
+    by_label["all"] = samples
+
+    endpoints = {}
+    for label, group in by_label.items():
+        latencies = [seconds * 1000 for _, seconds, ok in group if ok]
+        endpoints[label] = {
+            "requests": len(group),
+            "errors": sum(1 for _, _, ok in group if not ok),
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+        }
+
+    workers = {}
+    if sampler is not None:
+        for pid in sorted(sampler.peak):
+            workers[str(pid)] = {
+                "peak_rss_mib": sampler.peak[pid] / 1024,
+                "last_rss_mib": sampler.last.get(pid, 0) / 1024,
+            }
+
+    return {
+        "elapsed_s": elapsed,
+        "sessions": sessions,
+        "requests_per_s": len(samples) / elapsed if elapsed else float("nan"),
+        "sessions_per_s": sessions / elapsed if elapsed else float("nan"),
+        "endpoints": endpoints,
+        "workers": workers,
+    }
+
+
+def print_report(summary: Dict[str, Any]) -> None:
+    """Print the summary produced by ``report`` as plain-text tables."""
+    print(
+        "\n{sessions} sessions in {elapsed_s:.1f}s: {requests_per_s:.1f} req/s, "
+        "{sessions_per_s:.2f} sessions/s\n".format(**summary)
+    )
+    print(
+        "{:<20} {:>8} {:>7} {:>9} {:>9} {:>9}".format(
+            "endpoint", "requests", "errors", "p50 ms", "p95 ms", "p99 ms"
+        )
+    )
+    for label, stats in summary["endpoints"].items():
+        print(
+            "{:<20} {requests:>8} {errors:>7} {p50_ms:>9.1f} {p95_ms:>9.1f} "
+            "{p99_ms:>9.1f}".format(label, **stats)
+        )
+    if summary["workers"]:
+        print("\n{:<10} {:>14} {:>14}".format("worker", "peak RSS MiB", "last RSS MiB"))
+        for pid, stats in summary["workers"].items():
+            print(
+                "{:<10} {peak_rss_mib:>14.1f} {last_rss_mib:>14.1f}".format(
+                    pid, **stats
+                )
+            )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=20, help="sessions to replay")
+    parser.add_argument(
+        "--concurrency", type=int, default=4, help="sessions running at once"
+    )
+    parser.add_argument(
+        "--rows", type=int, default=5, help="table rows selected per session"
+    )
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers")
+    parser.add_argument("--worker-class", default="sync", help="gunicorn worker class")
+    parser.add_argument(
+        "--threads", type=int, default=1, help="threads per gthread worker"
+    )
+    parser.add_argument(
+        "--scale", type=int, default=1, help="repeat the dataset this many times"
+    )
+    parser.add_argument(
+        "--port", type=int, help="port to bind (default: any free port)"
+    )
+    parser.add_argument(
+        "--url",
+        help="target an already running server instead of starting gunicorn "
+        "(worker RSS is not reported)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--json", help="also write the report to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.threads > 1 and args.worker_class != "gthread":
+        print("--threads only applies to --worker-class gthread", file=sys.stderr)
+        return 2
+    server = None
+    sampler = None
+    with tempfile.TemporaryDirectory() as scratch:
+        if args.url:
+            base_url = args.url.rstrip("/")
+        else:
+            port = args.port or free_port()
+            base_url = "http://127.0.0.1:{}".format(port)
+            dataset = write_dataset(args.scale, scratch)
+            server = start_server(
+                port, args.workers, args.worker_class, args.threads, dataset
+            )
+        try:
+            wait_until_ready(base_url, server, timeout=120)
+            # gunicorn retries a busy port for a few seconds, during which
+            # another server on it could have answered the readiness check.
+            if server is not None and (
+                server.poll() is not None or not worker_pids(server.pid)
+            ):
+                raise RuntimeError(
+                    "gunicorn is not serving {}; is the port in use?".format(base_url)
+                )
+            _, body = timed_request("_dash-layout", base_url + "/_dash-layout")
+            if body is None:
+                raise RuntimeError("could not fetch _dash-layout")
+            layout = json.loads(body.decode("utf-8"))
+            dropdown = find_component(layout, "location-dropdown")
+            table = find_component(layout, "datatable")
+            if dropdown is None or table is None:
+                raise RuntimeError("layout is missing location-dropdown or datatable")
+            cities = [option["value"] for option in dropdown["props"]["options"]]
+            row_count = len(table["props"]["data"])
+
+            if server is not None:
+                sampler = RssSampler(server.pid)
+                sampler.start()
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                futures = [
+                    pool.submit(
+                        run_session,
+                        base_url,
+                        cities,
+                        row_count,
+                        args.rows,
+                        args.seed + session,
+                    )
+                    for session in range(args.sessions)
+                ]
+                samples = [sample for future in futures for sample in future.result()]
+            elapsed = time.perf_counter() - start
+
+            if sampler is not None:
+                sampler.stop()
+                if not sampler.peak:
+                    raise RuntimeError("no gunicorn workers were sampled")
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=30)
+
+    summary = report(samples, elapsed, args.sessions, sampler)
+    print_report(summary)
+    if args.json:
+        with open(args.json, "w") as handle:
+            json.dump(summary, handle, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())